@@ -1,37 +1,169 @@
 # admin_dashboard.py - Master Control Center
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from models import get_db, Clinic, Patient, ConversationState, Consultation
-from datetime import datetime
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, flash, jsonify, make_response, session
+from sqlalchemy import and_, func, or_
+from models import get_db, get_clinic_version, bump_clinic_version, Clinic, Patient, ConversationState, Consultation
+from config import ADMIN_PAGE_SIZE, ADMIN_STATS_TTL
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from status_ingest import delivery_stats
+import base64
+import binascii
+import hashlib
 import os
 import secrets
+import time
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "afyacare-super-secret-key-change-in-production")
 
 # ==================== ADMIN ROUTES ====================
 
+# ==================== PAGINATION & CACHING HELPERS ====================
+
+def encode_cursor(clinic):
+    """Opaque keyset cursor: position after this clinic in (created_at, id) desc order"""
+    raw = f"{clinic.created_at.isoformat()}|{clinic.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor - aborts with 400 on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, clinic_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), clinic_id
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        abort(400, "Invalid cursor")
+
+def get_clinic_filters():
+    """Search/filter params from the query string, empty ones dropped"""
+    filters = {
+        "q": request.args.get("q", "").strip(),
+        "plan": request.args.get("plan", "").strip(),
+        "active": request.args.get("active", "").strip().lower(),
+    }
+    return {k: v for k, v in filters.items() if v}
+
+def load_clinic_page(db, filters, cursor=None, page_size=ADMIN_PAGE_SIZE):
+    """One keyset page of clinics with stats. Returns (clinic_data, next_cursor)."""
+    query = db.query(Clinic)
+    
+    if "q" in filters:
+        like = f"%{filters['q']}%"
+        query = query.filter(or_(Clinic.name.ilike(like), Clinic.id.ilike(like), Clinic.phone.ilike(like)))
+    if "plan" in filters:
+        query = query.filter(Clinic.plan == filters["plan"])
+    if filters.get("active") in ("true", "false"):
+        query = query.filter(Clinic.is_active == (filters["active"] == "true"))
+    
+    if cursor:
+        created_at, clinic_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Clinic.created_at < created_at,
+            and_(Clinic.created_at == created_at, Clinic.id < clinic_id)
+        ))
+    
+    clinics = query.order_by(Clinic.created_at.desc(), Clinic.id.desc()).limit(page_size + 1).all()
+    next_cursor = encode_cursor(clinics[page_size - 1]) if len(clinics) > page_size else None
+    clinics = clinics[:page_size]
+    
+    # Stats for the whole page in two grouped queries instead of two per clinic
+    clinic_ids = [clinic.id for clinic in clinics]
+    patient_counts = dict(
+        db.query(Patient.clinic_id, func.count(Patient.id))
+        .filter(Patient.clinic_id.in_(clinic_ids))
+        .group_by(Patient.clinic_id).all()
+    )
+    msg_counts = dict(
+        db.query(ConversationState.clinic_id, func.count(ConversationState.id))
+        .filter(
+            ConversationState.clinic_id.in_(clinic_ids),
+            ConversationState.updated_at >= datetime.utcnow().date()
+        )
+        .group_by(ConversationState.clinic_id).all()
+    )
+    
+    clinic_data = [{
+        "clinic": clinic,
+        "patients": patient_counts.get(clinic.id, 0),
+        "today_messages": msg_counts.get(clinic.id, 0)
+    } for clinic in clinics]
+    
+    return clinic_data, next_cursor
+
+def conditional_on_clinics(view):
+    """
+    ETag/Last-Modified validators derived from the clinic-table version counter.
+    A matching If-None-Match / If-Modified-Since gets a 304 before the view
+    (and its queries) runs. Validators also roll over every ADMIN_STATS_TTL
+    seconds so patient/message counts can't go stale indefinitely.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Pages carrying flash messages are one-off - never cache them
+        if session.get("_flashes"):
+            response = make_response(view(*args, **kwargs))
+            response.cache_control.no_store = True
+            return response
+        
+        version, modified = get_clinic_version()
+        bucket = int(time.time()) // ADMIN_STATS_TTL
+        etag = hashlib.sha1(f"{version}:{bucket}:{request.full_path}".encode()).hexdigest()
+        last_modified = max(
+            modified.replace(tzinfo=timezone.utc),
+            datetime.fromtimestamp(bucket * ADMIN_STATS_TTL, timezone.utc)
+        )
+        
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+        
+        response = Response(status=304) if not_modified else make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    
+    return wrapper
+
+# ==================== ADMIN ROUTES ====================
+
 @app.route("/admin")
+@conditional_on_clinics
 def admin_panel():
-    """Main dashboard - show all clinics"""
+    """Main dashboard - one page of clinics, newest first"""
     db = get_db()
-    clinics = db.query(Clinic).order_by(Clinic.created_at.desc()).all()
-    
-    # Calculate stats for each clinic
-    clinic_data = []
-    for clinic in clinics:
-        patient_count = db.query(Patient).filter_by(clinic_id=clinic.id).count()
-        msg_count = db.query(ConversationState).filter(
-            ConversationState.clinic_id == clinic.id,
-            ConversationState.updated_at >= datetime.utcnow().date()
-        ).count()
-        
-        clinic_data.append({
-            "clinic": clinic,
-            "patients": patient_count,
-            "today_messages": msg_count
-        })
+    filters = get_clinic_filters()
+    cursor = request.args.get("cursor")
+    clinic_data, next_cursor = load_clinic_page(db, filters, cursor)
+    
+    return render_template("admin_panel.html",
+                         clinic_data=clinic_data,
+                         filters=filters,
+                         cursor=cursor,
+                         next_cursor=next_cursor)
+
+@app.route("/admin/api/clinics")
+@conditional_on_clinics
+def clinics_api():
+    """Same page as /admin, as JSON"""
+    db = get_db()
+    clinic_data, next_cursor = load_clinic_page(db, get_clinic_filters(), request.args.get("cursor"))
     
-    return render_template("admin_panel.html", clinic_data=clinic_data)
+    return jsonify({
+        "clinics": [{
+            "id": data["clinic"].id,
+            "name": data["clinic"].name,
+            "phone": data["clinic"].phone,
+            "plan": data["clinic"].plan,
+            "is_active": data["clinic"].is_active,
+            "created_at": data["clinic"].created_at.isoformat(),
+            "patients": data["patients"],
+            "today_messages": data["today_messages"]
+        } for data in clinic_data],
+        "next_cursor": next_cursor
+    })
 
 @app.route("/admin/create", methods=["GET", "POST"])
 def create_clinic():
@@ -112,11 +244,20 @@ def reset_clinic(clinic_id):
     db.query(Patient).filter_by(clinic_id=clinic_id).delete()
     db.query(ConversationState).filter_by(clinic_id=clinic_id).delete()
     db.query(Consultation).filter_by(clinic_id=clinic_id).delete()
+    bump_clinic_version(db)  # Bulk deletes bypass the flush hook; counts on the dashboard changed
     db.commit()
     
     flash(f"🚨 All data cleared for clinic {clinic_id}", "warning")
     return redirect(url_for("admin_panel"))
 
+@app.route("/admin/delivery-stats")
+def delivery_stats_view():
+    """Per-clinic delivery success rate and latency (JSON)"""
+    db = get_db()
+    days = request.args.get("days", type=int)
+    since = datetime.utcnow() - timedelta(days=days) if days else None
+    return jsonify(delivery_stats(db, since=since))
+
 # ==================== RUN THE APP ====================
 if __name__ == "__main__":
     app.run(debug=True, port=5001)  # Run on port 5001 to avoid conflicts
\ No newline at end of file
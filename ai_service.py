@@ -1,9 +1,13 @@
 # ai_service.py - AI Triage Service
 from openai import OpenAI
 from config import OPENAI_API_KEY, OPENAI_MODEL, MAX_TOKENS, TEMPERATURE
+from symptom_classifier import classify_if_confident
 import json
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+
 client = OpenAI(api_key=OPENAI_API_KEY)
 
 def analyze_symptoms(symptom_text, patient_name="Patient"):
@@ -58,7 +62,7 @@ Rules:
         return result
         
     except Exception as e:
-        print(f"AI Service Error: {e}")
+        logger.error("AI Service Error: %s", e)
         # Fallback response
         return {
             "severity": "medium",
@@ -71,6 +75,22 @@ Rules:
             "disclaimer": "This is not a medical diagnosis. Please consult a doctor."
         }
 
+def assess_symptoms(symptom_text, patient_name="Patient"):
+    """
+    Triage entry point: answer locally when the offline classifier is
+    confident, otherwise fall back to analyze_symptoms (OpenAI).
+    Emergency terms always go to the LLM; a broken local model is skipped.
+    """
+    try:
+        result = classify_if_confident(symptom_text)
+    except Exception as e:
+        logger.error("Local symptom classifier failed: %s", e)
+        result = None
+    if result is not None:
+        logger.info("Symptoms triaged locally", extra={"severity": result["severity"], "confidence": result["confidence"]})
+        return result
+    return analyze_symptoms(symptom_text, patient_name)
+
 def generate_response(message_history, current_state, context=None):
     """
     Generate contextual response based on conversation state
@@ -105,5 +125,5 @@ Respond in 2-3 short sentences maximum."""
         return response.choices[0].message.content.strip()
         
     except Exception as e:
-        print(f"Response Generation Error: {e}")
+        logger.error("Response Generation Error: %s", e)
         return "I'm here to help. Could you please tell me your symptoms so I can assist you better?"
\ No newline at end of file
@@ -13,12 +13,11 @@ from config_meta import (
     WEBHOOK_VERIFY_TOKEN
 )
 from datetime import datetime
+from log_config import setup_logging, should_log_payload, LazyJSON
+from status_ingest import status_buffer, parse_statuses
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Setup logging - queued, structured, phone numbers redacted
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -52,7 +51,8 @@ def whatsapp_webhook():
         # Incoming message from Meta
         try:
             data = request.get_json()
-            logger.info(f"📥 Incoming webhook: {data}")
+            if should_log_payload():
+                logger.info("📥 Incoming webhook payload: %s", LazyJSON(data))
             
             # Extract message details
             if "entry" in data and data["entry"]:
@@ -61,12 +61,15 @@ def whatsapp_webhook():
                         for change in entry["changes"]:
                             if "value" in change:
                                 value = change["value"]
+                                if "statuses" in value:
+                                    # Fast path: buffer for batched insert, no DB work per callback
+                                    status_buffer.add_many(parse_statuses(value))
                                 if "messages" in value and value["messages"]:
                                     message = value["messages"][0]
                                     from_number = message["from"]
                                     msg_body = message["text"]["body"]
                                     
-                                    logger.info(f"📱 Message from {from_number}: {msg_body}")
+                                    logger.info("📱 Message received", extra={"from_number": from_number, "chars": len(msg_body)})
                                     
                                     # Process through your triage logic
                                     reply_text = triage(msg_body, from_number)
@@ -79,7 +82,7 @@ def whatsapp_webhook():
             return jsonify({"status": "success"}), 200
             
         except Exception as e:
-            logger.error(f"💥 Error processing webhook: {str(e)}")
+            logger.exception("💥 Error processing webhook: %s", e)
             return jsonify({"status": "error", "message": str(e)}), 500
 
 def send_whatsapp_message(to_number, message_text):
@@ -100,12 +103,12 @@ def send_whatsapp_message(to_number, message_text):
         response = requests.post(META_API_URL, headers=headers, json=payload)
         
         if response.status_code == 200:
-            logger.info(f"✅ Message sent to {to_number}")
+            logger.info("✅ Message sent", extra={"to_number": to_number})
         else:
-            logger.error(f"❌ Failed to send message: {response.text}")
+            logger.error("❌ Failed to send message: %s", response.text, extra={"to_number": to_number, "status_code": response.status_code})
             
     except Exception as e:
-        logger.error(f"💥 Error sending message: {str(e)}")
+        logger.exception("💥 Error sending message: %s", e)
 
 @app.route("/health", methods=["GET"])
 def health_check():
@@ -122,7 +125,7 @@ def health_check():
         }, 200
         
     except Exception as e:
-        logger.error(f"💥 Health check failed: {str(e)}")
+        logger.error("💥 Health check failed: %s", e)
         return {
             "status": "unhealthy", 
             "error": str(e)
@@ -0,0 +1,381 @@
+# booking.py - Cal.com Booking with Cached Slot Availability
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import requests
+
+from config import (
+    CAL_API_URL, CAL_TIMEOUT, CLINIC_TIMEZONE,
+    SLOT_CACHE_TTL, SLOT_REFRESH_INTERVAL, SLOT_TRACK_IDLE, SLOT_HOLD_SECONDS,
+    SLOT_DAYS_AHEAD, SLOTS_OFFERED
+)
+from config_meta import CAL_API_KEY
+from models import get_db, Appointment, Patient
+
+logger = logging.getLogger(__name__)
+
+
+class CalClient:
+    """Thin Cal.com v1 API client. `base_url` can point at a local fake server."""
+
+    def __init__(self, api_key=CAL_API_KEY, base_url=CAL_API_URL, timeout=CAL_TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get_slots(self, event_type_id, start, end, time_zone=CLINIC_TIMEZONE):
+        """Available start times (ISO strings with offset), sorted"""
+        response = self.session.get(
+            f"{self.base_url}/slots",
+            params={
+                "apiKey": self.api_key,
+                "eventTypeId": event_type_id,
+                "startTime": start.isoformat(),
+                "endTime": end.isoformat(),
+                "timeZone": time_zone,
+            },
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        days = response.json().get("slots", {})
+        return sorted(slot["time"] for day in days.values() for slot in day)
+
+    def create_booking(self, event_type_id, start, name, email, metadata=None, time_zone=CLINIC_TIMEZONE):
+        response = self.session.post(
+            f"{self.base_url}/bookings",
+            params={"apiKey": self.api_key},
+            json={
+                "eventTypeId": int(event_type_id),
+                "start": start,
+                "responses": {"name": name, "email": email, "location": {"value": "inPerson", "optionValue": ""}},
+                "timeZone": time_zone,
+                "language": "en",
+                "metadata": metadata or {},
+            },
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+def parse_slot(slot):
+    """Cal.com ISO time -> aware datetime"""
+    return datetime.fromisoformat(slot.replace("Z", "+00:00"))
+
+
+def format_slot(slot):
+    """WhatsApp-friendly label in the clinic's local time, e.g. 'Mon 20 Oct, 09:30'"""
+    return parse_slot(slot).astimezone(ZoneInfo(CLINIC_TIMEZONE)).strftime("%a %d %b, %H:%M")
+
+
+class SlotCache:
+    """
+    Availability per Cal.com event type, refreshed in the background.
+
+    Entries and holds are keyed by event type because that is all Cal.com
+    separates availability by: every clinic booking the same event type
+    shares one calendar, so a hold must hide the slot from all of them.
+    Key by clinic too only once each clinic has its own event type.
+
+    Reads never touch the network: callers get the cached slots if they are
+    younger than `ttl`, otherwise an empty list (and a refresh is scheduled).
+    Keys are refreshed every `refresh_interval` seconds while someone has
+    asked for them within `track_idle` seconds.
+
+    Reservations are optimistic: `reserve` puts a local hold on a slot so it
+    isn't offered to anyone else, and the Cal.com booking is confirmed
+    afterwards. A failed booking releases the hold.
+    """
+
+    def __init__(self, client=None, ttl=SLOT_CACHE_TTL, refresh_interval=SLOT_REFRESH_INTERVAL,
+                 track_idle=SLOT_TRACK_IDLE, hold_seconds=SLOT_HOLD_SECONDS, days_ahead=SLOT_DAYS_AHEAD):
+        self.client = client or CalClient()
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.track_idle = track_idle
+        self.hold_seconds = hold_seconds
+        self.days_ahead = days_ahead
+        self._entries = {}  # key -> (slots, fetched_at)
+        self._tracked = {}  # key -> last requested
+        self._holds = {}  # (key, slot) -> (owner, expires)
+        self._failed = {}  # key -> last failed fetch, so an outage isn't retried on every request
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    # ==================== READS (no network) ====================
+
+    def track(self, event_type_id):
+        """Start (or keep) refreshing this event type - call ahead of when slots are needed"""
+        key = str(event_type_id)
+        with self._lock:
+            self._tracked[key] = time.monotonic()
+            missing = key not in self._entries
+        self._ensure_started()
+        if missing:
+            self._wakeup.set()
+
+    def get_slots(self, event_type_id, limit=SLOTS_OFFERED, owner=None):
+        """Up to `limit` upcoming, unheld slots from the cache"""
+        key = str(event_type_id)
+        self.track(event_type_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or now - entry[1] > self.ttl:
+                self._wakeup.set()
+                return []
+            cutoff = datetime.now(timezone.utc)
+            available = []
+            for slot in entry[0]:
+                hold = self._holds.get((key, slot))
+                if hold and hold[1] > now and hold[0] != owner:
+                    continue
+                if parse_slot(slot) <= cutoff:
+                    continue
+                available.append(slot)
+                if len(available) >= limit:
+                    break
+            return available
+
+    def reserve(self, event_type_id, slot, owner):
+        """
+        Optimistically hold `slot` for `owner`. False if the slot has passed,
+        is no longer in the fresh cached availability, or someone else holds it.
+        """
+        key = str(event_type_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or now - entry[1] > self.ttl or slot not in entry[0]:
+                return False
+            if parse_slot(slot) <= datetime.now(timezone.utc):
+                return False
+            hold = self._holds.get((key, slot))
+            if hold and hold[1] > now and hold[0] != owner:
+                return False
+            self._holds[(key, slot)] = (owner, now + self.hold_seconds)
+            return True
+
+    def release(self, event_type_id, slot):
+        with self._lock:
+            self._holds.pop((str(event_type_id), slot), None)
+
+    def invalidate(self, event_type_id):
+        """Drop cached availability (e.g. after Cal.com rejected a booking) and refetch"""
+        with self._lock:
+            self._entries.pop(str(event_type_id), None)
+        self._wakeup.set()
+
+    # ==================== BACKGROUND REFRESH ====================
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="slot-refresher", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.refresh_due()
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def refresh_due(self):
+        """Fetch every tracked key that is missing or older than refresh_interval"""
+        now = time.monotonic()
+        with self._lock:
+            for key, last_requested in list(self._tracked.items()):
+                if now - last_requested > self.track_idle:
+                    del self._tracked[key]
+                    self._entries.pop(key, None)
+            for hold_key, (_, expires) in list(self._holds.items()):
+                if expires <= now:
+                    del self._holds[hold_key]
+            due = [
+                key for key in self._tracked
+                if (key not in self._entries or now - self._entries[key][1] >= self.refresh_interval)
+                and now - self._failed.get(key, float("-inf")) >= self.refresh_interval
+            ]
+
+        for key in due:
+            self.refresh(key)
+
+    def refresh(self, event_type_id):
+        key = str(event_type_id)
+        start = datetime.now(timezone.utc)
+        try:
+            slots = self.client.get_slots(event_type_id, start, start + timedelta(days=self.days_ahead))
+        except Exception as e:
+            logger.error("💥 Slot refresh failed for %s: %s", key, e)
+            with self._lock:
+                self._failed[key] = time.monotonic()
+            return
+        with self._lock:
+            self._entries[key] = (tuple(slots), time.monotonic())
+            self._failed.pop(key, None)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+
+# Singleton instance
+slot_cache = SlotCache()
+
+_booking_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cal-booking")
+
+
+_sender = None
+
+
+def notify_patient(phone, text):
+    """Outbound WhatsApp message from a background thread; errors are logged, not raised"""
+    global _sender
+    try:
+        if _sender is None:
+            from campaigns import MetaSender
+            _sender = MetaSender(pool_size=2)
+        _sender(phone, text)
+    except Exception as e:
+        logger.error("💥 Failed to notify patient: %s", e, extra={"to_number": phone})
+
+
+def book_async(appointment_id, slot, cache=None, notify=notify_patient):
+    """Confirm a pending appointment with Cal.com off the request thread"""
+    return _booking_pool.submit(confirm_booking, appointment_id, slot, cache or slot_cache, notify)
+
+
+def confirm_booking(appointment_id, slot, cache, notify=notify_patient):
+    """
+    Create the Cal.com booking for a pending appointment. On failure the
+    local hold is released, the event type's availability refetched and the
+    patient messaged. A confirmed slot keeps its hold until it drops out
+    of the next refresh.
+    """
+    db = get_db()
+    try:
+        appointment = db.query(Appointment).get(appointment_id)
+        if not appointment or appointment.status != "pending":
+            return appointment
+        patient = db.query(Patient).filter_by(phone=appointment.patient_phone, clinic_id=appointment.clinic_id).first()
+
+        try:
+            booking = cache.client.create_booking(
+                appointment.event_type_id,
+                slot,
+                name=(patient.name if patient and patient.name else "WhatsApp Patient"),
+                email=f"{appointment.patient_phone.lstrip('+')}@patients.wca.invalid",  # Cal.com requires an email
+                metadata={"reference": appointment.reference_number, "clinic_id": appointment.clinic_id}
+            )
+            appointment.status = "confirmed"
+            appointment.cal_booking_uid = str(booking.get("uid") or booking.get("id") or "")
+            logger.info("✅ Appointment confirmed", extra={"reference": appointment.reference_number})
+        except Exception as e:
+            appointment.status = "failed"
+            cache.release(appointment.event_type_id, slot)
+            cache.invalidate(appointment.event_type_id)
+            logger.error("❌ Cal.com booking failed: %s", e, extra={"reference": appointment.reference_number})
+
+        db.commit()
+        if appointment.status == "failed":
+            # The patient was told the booking is pending - tell them it fell through
+            notify(appointment.patient_phone, f"""😔 *Appointment Not Booked*
+
+We couldn't book {format_slot(slot)} (ref `{appointment.reference_number}`). The time may have just been taken.
+
+Type NEW to choose another time.""")
+        return appointment
+    finally:
+        db.close()
+
+
+# ==================== LOCAL FAKE CAL.COM ====================
+
+def _fake_cal_server(latency=0.5, port=0):
+    """
+    Minimal stand-in for the Cal.com v1 /slots and /bookings endpoints.
+    Serves hourly slots for the next few days; each slot can be booked once.
+    Returns (server, base_url); stop with server.shutdown().
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    eat = timezone(timedelta(hours=3))
+    today = datetime.now(eat).replace(hour=0, minute=0, second=0, microsecond=0)
+    free = {(today + timedelta(days=d, hours=h)).isoformat() for d in range(1, 4) for h in range(9, 17)}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            time.sleep(latency)
+            days = {}
+            with lock:
+                for slot in sorted(free):
+                    days.setdefault(slot[:10], []).append({"time": slot})
+            self._reply(200, {"slots": days})
+
+        def do_POST(self):
+            time.sleep(latency)
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                if body["start"] not in free:
+                    return self._reply(409, {"message": "Slot no longer available"})
+                free.discard(body["start"])
+            self._reply(200, {"uid": f"fake-{len(free)}", "startTime": body["start"]})
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _benchmark(n=1000):
+    """Live availability fetch vs cached lookup, against the local fake server"""
+    server, base_url = _fake_cal_server(latency=0.5)
+    cache = SlotCache(CalClient(api_key="test", base_url=base_url), refresh_interval=5)
+
+    start = time.perf_counter()
+    cache.client.get_slots("1", datetime.now(timezone.utc), datetime.now(timezone.utc) + timedelta(days=7))
+    print(f"live fetch:        {(time.perf_counter() - start) * 1e3:8.1f} ms")
+
+    cache.refresh("1")
+    start = time.perf_counter()
+    for _ in range(n):
+        slots = cache.get_slots("1")
+    print(f"cached get_slots:  {(time.perf_counter() - start) / n * 1e6:8.1f} µs  ({len(slots)} offered)")
+
+    # Two patients race for the same slot: the second is refused locally
+    slot = slots[0]
+    assert cache.reserve("1", slot, owner="patient-a")
+    assert not cache.reserve("1", slot, owner="patient-b")
+    assert slot not in cache.get_slots("1", owner="patient-b")
+    assert not cache.reserve("1", "2000-01-03T06:00:00Z", owner="patient-b")  # gone / in the past
+    cache.client.create_booking("1", slot, name="A", email="a@example.invalid")
+    print(f"optimistic hold:   {format_slot(slot)} held for patient-a, hidden from patient-b")
+
+    cache.stop()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    _benchmark()
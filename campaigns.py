@@ -0,0 +1,457 @@
+# campaigns.py - Throughput-Controlled Outbound Campaigns
+"""
+Follow-ups after consultations and reminders for patients who haven't
+visited in a while.
+
+Recipients are fetched in keyset batches (id > checkpoint, ordered by id,
+LIMIT batch size) on the same session that records claims, so no read
+cursor is held open across commits. Each batch is first *claimed* (one
+CampaignMessage row per recipient, unique per campaign), then sent through
+a bounded thread pool behind a token-bucket rate limiter, then its outcomes
+and the run checkpoint are committed together. A restarted run resumes
+after the last checkpoint, and the unique claim means nobody is messaged
+twice.
+
+Transient send errors (timeouts, 5xx, Meta throttling) are retried with
+exponential backoff inside the run; Meta's throughput error 130429 also
+pauses the shared token bucket. A message still failing transiently is
+left as `retry` and claimed again by the next run. Permanent errors are
+`failed` for good. Claims left `queued` by a crash are not retried
+(at-most-once), since the message may already have gone out.
+
+Both campaigns go out days after the patient's last message, outside Meta's
+24h customer-service window, so each requires an approved template
+(FOLLOWUP_TEMPLATE / REMINDER_TEMPLATE) and refuses to start without one.
+
+    python campaigns.py followup|reminder [--limit N]
+    python campaigns.py bench
+"""
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import and_
+
+from models import get_db, Clinic, Patient, Consultation, CampaignRun, CampaignMessage
+from config import (
+    CAMPAIGN_CONCURRENCY, CAMPAIGN_RATE_PER_SECOND, CAMPAIGN_BATCH_SIZE,
+    CAMPAIGN_SEND_ATTEMPTS, CAMPAIGN_RETRY_BACKOFF,
+    FOLLOWUP_AFTER_DAYS, FOLLOWUP_WINDOW_DAYS, REMINDER_AFTER_DAYS,
+    FOLLOWUP_TEMPLATE, REMINDER_TEMPLATE
+)
+from config_meta import PHONE_NUMBER_ID, ACCESS_TOKEN
+
+logger = logging.getLogger(__name__)
+
+META_API_URL = f"https://graph.facebook.com/v18.0/{PHONE_NUMBER_ID}/messages"
+
+# Meta error codes worth retrying: temporary/unknown errors, service unavailable,
+# per-recipient pair rate limit, and the throughput/rate limits below
+TRANSIENT_ERROR_CODES = {1, 2, 4, 80007, 130429, 131000, 131016, 131056, 133004}
+# Account-wide rate limits - every sender should slow down, not just retry
+THROTTLE_ERROR_CODES = {4, 80007, 130429}
+
+
+# ==================== SENDING ====================
+
+class TokenBucket:
+    """Thread-safe rate limiter: `rate` sends/second with bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, seconds):
+        """Pause every caller for about `seconds` (e.g. after Meta returns 130429)"""
+        with self.lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class SendError(Exception):
+    """A failed send. `transient` errors may succeed later; `throttled` ones mean slow down."""
+
+    def __init__(self, message, code=None, transient=False, throttled=False):
+        super().__init__(message)
+        self.code = code
+        self.transient = transient
+        self.throttled = throttled
+
+
+class MetaSender:
+    """Sends via the Meta Cloud API on one pooled HTTP session. Returns the wamid."""
+
+    def __init__(self, pool_size=CAMPAIGN_CONCURRENCY):
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            "Authorization": f"Bearer {ACCESS_TOKEN}",
+            "Content-Type": "application/json"
+        })
+
+    def __call__(self, to_number, text, template=None, params=()):
+        if template:
+            # Business-initiated messages outside the 24h window must use an approved template
+            payload = {
+                "messaging_product": "whatsapp",
+                "to": to_number,
+                "type": "template",
+                "template": {
+                    "name": template,
+                    "language": {"code": "en"},
+                    "components": [{"type": "body", "parameters": [{"type": "text", "text": str(p)} for p in params]}]
+                }
+            }
+        else:
+            payload = {"messaging_product": "whatsapp", "to": to_number, "type": "text", "text": {"body": text}}
+
+        try:
+            response = self.session.post(META_API_URL, json=payload, timeout=10)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise SendError(f"network: {e}", transient=True) from e
+        if response.status_code != 200:
+            try:
+                code = response.json().get("error", {}).get("code")
+            except ValueError:
+                code = None
+            throttled = response.status_code == 429 or code in THROTTLE_ERROR_CODES
+            raise SendError(
+                f"{response.status_code}: {response.text[:150]}",
+                code=code,
+                transient=throttled or response.status_code >= 500 or code in TRANSIENT_ERROR_CODES,
+                throttled=throttled,
+            )
+        return response.json()["messages"][0]["id"]
+
+
+# ==================== CAMPAIGNS ====================
+
+class CampaignConfigError(Exception):
+    """Campaign can't run as configured - nothing has been claimed or sent"""
+
+
+class Campaign:
+    """
+    `fetch` returns up to `limit` recipients with source id > `after_id`,
+    ordered by id, as dicts with `id`, `key`, `phone`, template `params` and
+    a `text` preview of the message.
+    """
+    name = None
+    template = None
+    template_setting = None  # Config name to set when `template` is missing
+
+    def fetch(self, db, after_id, limit):
+        raise NotImplementedError
+
+
+class ConsultationFollowUp(Campaign):
+    name = "consultation_followup"
+    template = FOLLOWUP_TEMPLATE or None
+    template_setting = "FOLLOWUP_TEMPLATE"
+
+    def fetch(self, db, after_id, limit):
+        now = datetime.utcnow()
+        rows = db.query(
+            Consultation.id, Consultation.patient_phone, Consultation.reference_number, Clinic.name, Patient.name
+        ).join(Clinic, Clinic.id == Consultation.clinic_id).outerjoin(Patient, and_(
+            Patient.phone == Consultation.patient_phone,
+            Patient.clinic_id == Consultation.clinic_id
+        )).filter(
+            Consultation.id > after_id,
+            Consultation.status == "active",
+            Consultation.created_at <= now - timedelta(days=FOLLOWUP_AFTER_DAYS),
+            Consultation.created_at > now - timedelta(days=FOLLOWUP_WINDOW_DAYS),
+            Clinic.is_active == True
+        ).order_by(Consultation.id).limit(limit).all()
+
+        recipients = []
+        for consultation_id, phone, ref, clinic_name, patient_name in rows:
+            name = patient_name or "there"
+            recipients.append({
+                "id": consultation_id,
+                "key": f"consultation:{consultation_id}",
+                "phone": phone,
+                "text": f"Hi {name} 👋 This is {clinic_name}. How are you feeling since your consultation (ref {ref})?\n\nReply NEW if you need more help.",
+                "params": [name, clinic_name, ref],
+            })
+        return recipients
+
+
+class VisitReminder(Campaign):
+    name = "visit_reminder"
+    template = REMINDER_TEMPLATE or None
+    template_setting = "REMINDER_TEMPLATE"
+
+    def fetch(self, db, after_id, limit):
+        rows = db.query(
+            Patient.id, Patient.phone, Patient.name, Patient.last_visit, Clinic.name
+        ).join(Clinic, Clinic.id == Patient.clinic_id).filter(
+            Patient.id > after_id,
+            Patient.last_visit < datetime.utcnow() - timedelta(days=REMINDER_AFTER_DAYS),
+            Clinic.is_active == True
+        ).order_by(Patient.id).limit(limit).all()
+
+        recipients = []
+        for patient_id, phone, patient_name, last_visit, clinic_name in rows:
+            name = patient_name or "there"
+            recipients.append({
+                "id": patient_id,
+                # Keyed on the visit, so a later visit makes the patient eligible again
+                "key": f"patient:{patient_id}:{last_visit.date().isoformat()}",
+                "phone": phone,
+                "text": f"Hi {name} 👋 It's been a while since your last visit to {clinic_name}. Time for a check-up?\n\nReply NEW to talk to us.",
+                "params": [name, clinic_name],
+            })
+        return recipients
+
+
+CAMPAIGNS = {"followup": ConsultationFollowUp, "reminder": VisitReminder}
+
+
+# ==================== RUNNER ====================
+
+class CampaignRunner:
+    def __init__(self, sender=None, concurrency=CAMPAIGN_CONCURRENCY, rate=CAMPAIGN_RATE_PER_SECOND,
+                 batch_size=CAMPAIGN_BATCH_SIZE, attempts=CAMPAIGN_SEND_ATTEMPTS,
+                 retry_backoff=CAMPAIGN_RETRY_BACKOFF, session_factory=get_db):
+        self.sender = sender or MetaSender(pool_size=concurrency)
+        self.concurrency = concurrency
+        self.limiter = TokenBucket(rate)  # All sends share one business number
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.retry_backoff = retry_backoff
+        self.session_factory = session_factory
+
+    def _resume_or_start(self, db, campaign):
+        run = db.query(CampaignRun).filter_by(campaign=campaign.name, status="running").order_by(CampaignRun.id.desc()).first()
+        if run:
+            logger.info("Resuming campaign run %s after id %s", run.id, run.last_id)
+            return run
+        run = CampaignRun(campaign=campaign.name, last_id=0, sent=0, failed=0, status="running")
+        db.add(run)
+        db.commit()
+        return run
+
+    def _claim(self, db, campaign, run, batch):
+        """
+        Queue recipients not messaged before, and re-queue those whose last
+        attempt ended in a transient error (`retry`). Returns (recipient, claim) pairs.
+        """
+        fresh = {}
+        retries = {}
+        for recipient in batch:
+            if recipient["phone"] and recipient["key"] not in fresh:
+                fresh[recipient["key"]] = recipient
+        if fresh:
+            already = set()
+            for claim in db.query(CampaignMessage).filter(
+                CampaignMessage.campaign == campaign.name,
+                CampaignMessage.recipient_key.in_(list(fresh))
+            ):
+                if claim.status == "retry":
+                    retries[claim.recipient_key] = claim
+                else:
+                    already.add(claim.recipient_key)
+            # Also at most one message per phone per run (Meta rate-limits per recipient)
+            phones_this_run = {phone for (phone,) in db.query(CampaignMessage.phone).filter(
+                CampaignMessage.run_id == run.id,
+                CampaignMessage.phone.in_([r["phone"] for r in fresh.values()])
+            )}
+            seen_phones = set()
+            for key, recipient in list(fresh.items()):
+                if key in already or recipient["phone"] in phones_this_run or recipient["phone"] in seen_phones:
+                    del fresh[key]
+                else:
+                    seen_phones.add(recipient["phone"])
+
+        claims = []
+        for recipient in fresh.values():
+            claim = retries.get(recipient["key"])
+            if claim is not None:
+                # Conditional update, so two concurrent runs can't both re-claim it
+                updated = db.query(CampaignMessage).filter(
+                    CampaignMessage.id == claim.id, CampaignMessage.status == "retry"
+                ).update({"run_id": run.id, "phone": recipient["phone"], "status": "queued", "error": None},
+                         synchronize_session="fetch")
+                if not updated:
+                    continue
+            else:
+                claim = CampaignMessage(run_id=run.id, campaign=campaign.name, recipient_key=recipient["key"],
+                                        phone=recipient["phone"], status="queued")
+                db.add(claim)
+            claims.append((recipient, claim))
+        db.commit()  # Durable before anything is sent
+        return claims
+
+    def _send(self, campaign, recipient):
+        """Send one message, retrying transient errors with exponential backoff"""
+        for attempt in range(1, self.attempts + 1):
+            self.limiter.acquire()
+            try:
+                return self.sender(recipient["phone"], recipient["text"], template=campaign.template, params=recipient["params"])
+            except SendError as e:
+                if not e.transient or attempt == self.attempts:
+                    raise
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                if e.throttled:
+                    # Throttling applies to the whole number - pause every worker, not just this one
+                    logger.warning("Meta throttled campaign sends (%s) - backing off %.1fs", e.code, delay)
+                    self.limiter.backoff(delay)
+                else:
+                    time.sleep(delay)
+
+    def run(self, campaign, limit=None):
+        """
+        Send `campaign` to every eligible recipient (or at most `limit`).
+        Returns stats: sent, failed, retry (left for the next run), skipped,
+        elapsed seconds, messages/second.
+        Raises CampaignConfigError before touching the DB if no template is set.
+        """
+        if not campaign.template:
+            raise CampaignConfigError(
+                f"{campaign.name} sends outside the 24h window and needs an approved "
+                f"Meta template - set {campaign.template_setting}"
+            )
+
+        db = self.session_factory()
+        run = self._resume_or_start(db, campaign)
+        stats = {"run_id": run.id, "sent": 0, "failed": 0, "retry": 0, "skipped": 0}
+        start = time.perf_counter()
+        remaining = limit
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="campaign") as pool:
+                while remaining is None or remaining > 0:
+                    size = self.batch_size if remaining is None else min(self.batch_size, remaining)
+                    # Keyset page, fully read before any commit - no cursor held open
+                    batch = campaign.fetch(db, run.last_id, size)
+                    if not batch:
+                        run.status = "completed"
+                        run.finished_at = datetime.utcnow()
+                        db.commit()
+                        break
+
+                    claims = self._claim(db, campaign, run, batch)
+                    stats["skipped"] += len(batch) - len(claims)
+                    futures = [pool.submit(self._send, campaign, recipient) for recipient, _ in claims]
+
+                    now = datetime.utcnow()
+                    for (recipient, claim), future in zip(claims, futures):
+                        try:
+                            claim.message_id = future.result()
+                            claim.status = "sent"
+                            claim.sent_at = now
+                            stats["sent"] += 1
+                        except Exception as e:
+                            # Transient failures are claimed again by the next run
+                            claim.status = "retry" if isinstance(e, SendError) and e.transient else "failed"
+                            claim.error = str(e)[:200]
+                            stats[claim.status] += 1
+
+                    # Checkpoint together with the outcomes
+                    run.last_id = max(recipient["id"] for recipient in batch)
+                    run.sent = (run.sent or 0) + sum(1 for _, claim in claims if claim.status == "sent")
+                    run.failed = (run.failed or 0) + sum(1 for _, claim in claims if claim.status in ("failed", "retry"))
+                    db.commit()
+
+                    if remaining is not None:
+                        remaining -= len(batch)
+        finally:
+            db.close()
+
+        stats["elapsed"] = round(time.perf_counter() - start, 3)
+        stats["messages_per_second"] = round(stats["sent"] / stats["elapsed"], 1) if stats["elapsed"] else 0.0
+        logger.info("Campaign %s: %s", campaign.name, stats)
+        return stats
+
+
+# ==================== CLI ====================
+
+def _benchmark(n=2000, send_latency=0.05, failure_rate=0.02, outage_rate=0.01):
+    """Throughput and crash/resume against a temporary file-backed SQLite DB and a fake sender"""
+    import os
+    import random
+    import tempfile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+
+    # A real file, like production - exercises SQLite's locking between reads and commits
+    tmp_dir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    db.add(Clinic(id="bench", name="Bench Clinic", is_active=True))
+    old_visit = datetime.utcnow() - timedelta(days=REMINDER_AFTER_DAYS + 30)
+    db.add_all([Patient(clinic_id="bench", phone=f"2547{i:08}", name=f"P{i}", last_visit=old_visit) for i in range(n)])
+    db.commit()
+
+    sent_to = []
+    lock = threading.Lock()
+    down = set(random.Random(1).sample(range(n), int(n * outage_rate)))  # 5xx for the whole first pass
+
+    def fake_sender(to_number, text, template=None, params=()):
+        time.sleep(send_latency)
+        if int(to_number[4:]) in down and not fake_sender.recovered:
+            raise SendError("503: simulated outage", transient=True)
+        roll = random.random()
+        if roll < failure_rate / 2:
+            raise SendError("400: simulated 131026", code=131026)
+        if roll < failure_rate:
+            raise SendError("400: simulated 130429", code=130429, transient=True, throttled=True)
+        with lock:
+            sent_to.append(to_number)
+        return f"wamid.{to_number}"
+
+    campaign = VisitReminder()
+    campaign.template = "bench_reminder"
+    fake_sender.recovered = False
+    runner = CampaignRunner(sender=fake_sender, concurrency=CAMPAIGN_CONCURRENCY, rate=1000,
+                            retry_backoff=0.01, session_factory=Session)
+    first = runner.run(campaign, limit=n // 3)  # "crash" a third of the way through
+    second = runner.run(campaign)  # restart resumes from the checkpoint
+    fake_sender.recovered = True
+    third = runner.run(campaign)  # new run: only the outage's `retry` claims are sent
+
+    print(f"first run:   {first}")
+    print(f"resumed run: {second}")
+    print(f"re-run:      {third}")
+    print(f"{n} recipients, {len(sent_to)} delivered, {len(sent_to) - len(set(sent_to))} duplicates")
+    print(f"serial baseline would be ~{1 / send_latency:.0f} msg/s at {send_latency * 1e3:.0f} ms per send")
+
+    db.close()
+    engine.dispose()
+    os.remove(os.path.join(tmp_dir, "bench.db"))
+    os.rmdir(tmp_dir)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command in CAMPAIGNS:
+        limit = int(sys.argv[sys.argv.index("--limit") + 1]) if "--limit" in sys.argv else None
+        try:
+            print(CampaignRunner().run(CAMPAIGNS[command](), limit=limit))
+        except CampaignConfigError as e:
+            sys.exit(f"❌ {e}")
+    else:
+        _benchmark()
@@ -28,6 +28,47 @@ OPENAI_MODEL = "gpt-3.5-turbo"
 MAX_TOKENS = 300
 TEMPERATURE = 0.4
 
+# Local symptom classifier (skips the LLM for confident predictions)
+SYMPTOM_MODEL_PATH = os.getenv("SYMPTOM_MODEL_PATH", "symptom_model.npz")
+SYMPTOM_CLASSIFIER_THRESHOLD = float(os.getenv("SYMPTOM_CLASSIFIER_THRESHOLD", "0.85"))
+
+# Logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_JSON = os.getenv("LOG_JSON", "true").lower() == "true"
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))  # Fraction of full webhook payloads logged
+
+# Delivery status ingestion
+STATUS_BATCH_SIZE = int(os.getenv("STATUS_BATCH_SIZE", "200"))  # Flush when this many statuses are buffered
+STATUS_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", "2.0"))  # ...or after this many seconds
+STATUS_BUFFER_MAX = int(os.getenv("STATUS_BUFFER_MAX", "20000"))  # Drop oldest beyond this if the DB is down
+
+# Admin dashboard
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "20"))
+ADMIN_STATS_TTL = int(os.getenv("ADMIN_STATS_TTL", "60"))  # Seconds a cached page's patient/message counts may lag
+
+# Cal.com booking (credentials live in config_meta.py)
+CAL_API_URL = os.getenv("CAL_API_URL", "https://api.cal.com/v1")
+CAL_TIMEOUT = float(os.getenv("CAL_TIMEOUT", "10"))
+CLINIC_TIMEZONE = "Africa/Nairobi"
+SLOT_CACHE_TTL = int(os.getenv("SLOT_CACHE_TTL", "90"))  # Seconds before cached availability is considered stale
+SLOT_REFRESH_INTERVAL = int(os.getenv("SLOT_REFRESH_INTERVAL", "30"))  # Background refresh period
+SLOT_TRACK_IDLE = int(os.getenv("SLOT_TRACK_IDLE", "900"))  # Stop refreshing a clinic nobody has asked about for this long
+SLOT_HOLD_SECONDS = int(os.getenv("SLOT_HOLD_SECONDS", "300"))  # Optimistic hold on a chosen slot
+SLOT_DAYS_AHEAD = 7
+SLOTS_OFFERED = 5
+
+# Outbound campaigns
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "8"))  # Parallel sends in flight
+CAMPAIGN_RATE_PER_SECOND = float(os.getenv("CAMPAIGN_RATE_PER_SECOND", "20"))  # Per business number
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "200"))  # Recipients claimed + checkpointed together
+CAMPAIGN_SEND_ATTEMPTS = int(os.getenv("CAMPAIGN_SEND_ATTEMPTS", "3"))  # Tries per message for transient errors
+CAMPAIGN_RETRY_BACKOFF = float(os.getenv("CAMPAIGN_RETRY_BACKOFF", "2"))  # Seconds, doubled after each failed try
+FOLLOWUP_AFTER_DAYS = 2  # Follow up consultations at least this old...
+FOLLOWUP_WINDOW_DAYS = 7  # ...but no older than this
+REMINDER_AFTER_DAYS = 180  # Remind patients who haven't visited for this long
+FOLLOWUP_TEMPLATE = os.getenv("FOLLOWUP_TEMPLATE", "")  # Approved Meta template name; campaign refuses to run if empty
+REMINDER_TEMPLATE = os.getenv("REMINDER_TEMPLATE", "")
+
 # Database
 DATABASE_URL = "sqlite:///wca_pro.db"
 
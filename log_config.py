@@ -0,0 +1,243 @@
+# log_config.py - Non-blocking Structured Logging
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_JSON, LOG_PAYLOAD_SAMPLE_RATE
+
+# Phone numbers in free text: "+"-prefixed international numbers (spaces or
+# dashes allowed), or bare Kenyan numbers (2547.../2541..., 07.../01...).
+# Other digit runs - Meta timestamps, phone_number_id, wamids - are left alone;
+# structured fields are redacted by name instead (see PHONE_FIELDS).
+PHONE_PATTERN = re.compile(r"(?<![\w.+])(whatsapp:)?(\+\d[\d \-]{7,17}\d|254[17]\d{8}|0[17]\d{8})(?![\w])")
+
+# Payload / `extra=` keys that always hold a phone number
+PHONE_FIELDS = {
+    "from", "wa_id", "recipient_id", "to", "to_number", "from_number", "phone", "patient_phone",
+    "display_phone_number",
+}
+
+# `extra=` keys holding patient-written text or identity - never logged verbatim
+PRIVATE_FIELDS = {"body", "caption", "profile"}
+
+# Sampled webhook payloads are allowlisted, not blocklisted: only these keys
+# survive, everything else (text, button/list replies, locations, contact
+# cards, media captions, ...) becomes "[redacted]". Keys in PAYLOAD_CONTAINERS
+# are envelopes that are walked; PAYLOAD_SAFE_FIELDS are Meta-generated values
+# kept as-is; PHONE_FIELDS are kept masked.
+PAYLOAD_CONTAINERS = {
+    "entry", "changes", "value", "metadata", "messages", "statuses", "contacts",
+    "errors", "conversation", "origin", "pricing", "context",
+}
+PAYLOAD_SAFE_FIELDS = {
+    "object", "id", "field", "messaging_product", "phone_number_id", "type",
+    "timestamp", "status", "code", "title", "expiration_timestamp", "billable",
+    "pricing_model", "category",
+}
+
+# Attributes every LogRecord has - anything else came in via `extra=`
+_RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+def mask_number(number):
+    """Replace every digit except the last 4 with '*', keeping separators"""
+    number = str(number)
+    total = sum(c.isdigit() for c in number)
+    seen = 0
+    masked = []
+    for c in number:
+        if c.isdigit():
+            seen += 1
+            masked.append(c if seen > total - 4 else "*")
+        else:
+            masked.append(c)
+    return "".join(masked)
+
+
+def redact_phone(text):
+    """Mask phone numbers in free text, keeping the last 4 digits (e.g. +254 *** **6 761)"""
+    return PHONE_PATTERN.sub(lambda m: f"{m.group(1) or ''}{mask_number(m.group(2))}", text)
+
+
+def _redact_value(value, key=None):
+    if key in PHONE_FIELDS and isinstance(value, (str, int)):
+        return mask_number(value)
+    if key in PRIVATE_FIELDS:
+        return f"[redacted {len(value)} chars]" if isinstance(value, str) else "[redacted]"
+    if isinstance(value, str):
+        return redact_phone(value)
+    if isinstance(value, dict):
+        return {k: _redact_value(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact_value(v) for v in value]
+    return value
+
+
+def _allowlisted(value, key=None):
+    if value is None:
+        return None
+    if key in PHONE_FIELDS:
+        return mask_number(value) if isinstance(value, (str, int)) else "[redacted]"
+    if key in PAYLOAD_SAFE_FIELDS and isinstance(value, (str, int, float, bool)):
+        return value
+    if key is None or key in PAYLOAD_CONTAINERS:
+        if isinstance(value, dict):
+            return {k: _allowlisted(v, k) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_allowlisted(v, key) for v in value]
+    return f"[redacted {len(value)} chars]" if isinstance(value, str) else "[redacted]"
+
+
+def redact_payload(payload):
+    """
+    Copy of a webhook payload keeping only the envelope, ids, types,
+    timestamps, statuses and error codes. Phone fields are masked and
+    every other value - whatever the message type - is redacted.
+    """
+    return _allowlisted(payload)
+
+
+class LazyJSON:
+    """Defers redaction + json.dumps of a payload until a handler actually emits it"""
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return json.dumps(redact_payload(self.payload), default=str, ensure_ascii=False)
+
+
+def should_log_payload(rate=None):
+    """Sampling decision for full webhook payloads (0.0 = never, 1.0 = always)"""
+    rate = LOG_PAYLOAD_SAMPLE_RATE if rate is None else rate
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with phone numbers redacted"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact_phone(record.getMessage()),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = _redact_value(value, key)
+        if record.exc_info:
+            entry["exc"] = redact_phone(self.formatException(record.exc_info))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RedactingFormatter(logging.Formatter):
+    """Plain-text formatter for local development, still redacted"""
+
+    def format(self, record):
+        return redact_phone(super().format(record))
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that skips the stock prepare() step.
+    The default implementation formats the message in the request thread;
+    passing the record through untouched leaves all formatting to the
+    listener thread. Records never leave the process, so no pickling concerns.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=None, stream=None):
+    """
+    Route all logging through an in-memory queue drained by a background
+    QueueListener. Safe to call more than once - later calls are no-ops.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if LOG_JSON:
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(RedactingFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level or LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _benchmark(n=20000):
+    """Per-request caller-side cost: synchronous handler vs queue pipeline"""
+    import os
+
+    payload = {
+        "entry": [{"changes": [{"value": {
+            "contacts": [{"wa_id": "254724896761", "profile": {"name": "Jane"}}],
+            "messages": [{"from": "254724896761", "id": "wamid.X", "text": {"body": "I have a headache and fever"}}],
+        }}]}]
+    }
+    devnull = open(os.devnull, "w")
+    bench_logger = logging.getLogger("bench")
+
+    def run(label):
+        start = time.perf_counter()
+        for _ in range(n):
+            if should_log_payload(0.01):
+                bench_logger.info("Incoming webhook payload %s", LazyJSON(payload))
+            bench_logger.info("Message received", extra={"from_number": "254724896761", "chars": 27})
+        elapsed = time.perf_counter() - start
+        print(f"{label:<28} {elapsed / n * 1e6:8.2f} µs/request")
+
+    # Baseline: the old setup - f-string payload, formatting + I/O inline
+    sync = logging.StreamHandler(devnull)
+    sync.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    root.handlers[:] = [sync]
+    root.setLevel(logging.INFO)
+    start = time.perf_counter()
+    for _ in range(n):
+        bench_logger.info(f"📥 Incoming webhook: {payload}")
+        bench_logger.info(f"📱 Message from 254724896761: I have a headache and fever")
+    print(f"{'sync f-string (old)':<28} {(time.perf_counter() - start) / n * 1e6:8.2f} µs/request")
+
+    sync.setFormatter(JSONFormatter())
+    run("sync JSON, sampled")
+
+    setup_logging(logging.INFO, stream=devnull)
+    run("queued JSON, sampled")
+    shutdown_logging()
+    devnull.close()
+
+
+if __name__ == "__main__":
+    _benchmark()
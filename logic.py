@@ -1,8 +1,10 @@
 # logic.py - PRODUCTION VERSION
-from models import get_db, Clinic, Patient, Consultation, ConversationState, get_patient, get_or_create_state
-from ai_service import analyze_symptoms
+from models import get_db, Clinic, Patient, Consultation, ConversationState, Appointment, get_patient, get_or_create_state
+from ai_service import assess_symptoms
+from booking import slot_cache, book_async, format_slot, parse_slot
 from config import CLINIC_NAME
-from datetime import datetime
+from config_meta import EVENT_TYPE_ID
+from datetime import datetime, timezone
 import json
 import random
 
@@ -58,6 +60,8 @@ def triage(incoming_msg, phone, twilio_phone=None):
         return handle_triage_result(msg, phone, patient, context, clinic)
     elif state.state == "selecting_hospital":
         return handle_hospital_selection(msg, phone, patient, context, clinic)
+    elif state.state == "selecting_slot":
+        return handle_slot_selection(msg, phone, patient, context, clinic)
     elif state.state == "confirmed":
         return handle_confirmed(msg, phone, patient, context, clinic)
     
@@ -86,10 +90,16 @@ def handle_symptoms(msg, phone, patient, context, clinic):
     context["symptoms"] = msg
     update_state(phone, "triage_processing", context, clinic_id=clinic.id)
     
-    ai_result = analyze_symptoms(msg, patient.name or "Patient")
+    ai_result = assess_symptoms(msg, patient.name or "Patient")
     context["ai_result"] = ai_result
+    if ai_result["severity"] == "emergency":
+        context["is_emergency"] = True  # Saved with the state - no appointment menu later
     update_state(phone, "triage_complete", context, clinic_id=clinic.id)
     
+    if not context.get("is_emergency"):
+        # Warm the availability cache now so slots are ready by hospital selection
+        slot_cache.track(EVENT_TYPE_ID)
+    
     severity_emoji = {"low": "🟢", "medium": "🟡", "high": "🔴", "emergency": "🚨"}.get(ai_result["severity"], "⚪")
     
     response = f"""{severity_emoji} *Assessment Complete*
@@ -106,7 +116,6 @@ Reply YES to book or MORE for details."""
 {ai_result['assessment']}
 
 ⚠️ Go to hospital IMMEDIATELY!"""
-        context["is_emergency"] = True
     
     return response
 
@@ -157,21 +166,85 @@ def handle_hospital_selection(msg, phone, patient, context, clinic):
         db.add(consultation)
         db.commit()
         
-        update_state(phone, "confirmed", context, clinic_id=clinic.id)
-        
-        return f"""✅ *Booking Confirmed!*
+        response = f"""✅ *Booking Confirmed!*
 
 *Clinic:* {clinic.name}
 *Patient:* {patient.name}
 *Reference:* `{ref}`
-*Hospital:* {hospital['name']}
-
-Type NEW for another consultation."""
+*Hospital:* {hospital['name']}"""
+        
+        # Emergencies go to hospital now - never offer an appointment days away
+        if context.get("is_emergency"):
+            update_state(phone, "confirmed", context, clinic_id=clinic.id)
+            return response + "\n\n🚨 Go to the hospital now - do not wait for an appointment."
+        
+        # Served from the background-refreshed cache - never waits on Cal.com
+        slots = slot_cache.get_slots(EVENT_TYPE_ID, owner=phone)
+        if slots:
+            context["offered_slots"] = slots
+            update_state(phone, "selecting_slot", context, clinic_id=clinic.id)
+            return response + "\n\n" + slot_menu(slots)
+        
+        update_state(phone, "confirmed", context, clinic_id=clinic.id)
+        return response + "\n\nType NEW for another consultation."
     
     else:
         valid_options = ", ".join(HOSPITALS.keys())
         return f"❌ Invalid selection. Please reply: {valid_options}"
 
+def slot_menu(slots):
+    options = "\n".join([f"*{i}.* {format_slot(slot)}" for i, slot in enumerate(slots, 1)])
+    return f"📅 *Pick an appointment time*\n\n{options}\n\nReply with number (1-{len(slots)}) or SKIP."
+
+def handle_slot_selection(msg, phone, patient, context, clinic):
+    offered = context.get("offered_slots", [])
+    choice = msg.strip()
+    
+    if choice.upper() == "SKIP":
+        context.pop("offered_slots", None)
+        update_state(phone, "confirmed", context, clinic_id=clinic.id)
+        return "👍 No problem. Type NEW for another consultation."
+    
+    if not choice.isdigit() or not 1 <= int(choice) <= len(offered):
+        return f"❌ Invalid selection. Please reply 1-{len(offered)} or SKIP."
+    
+    slot = offered[int(choice) - 1]
+    # The menu may be hours old: reserve re-checks the slot against current availability
+    if not slot_cache.reserve(EVENT_TYPE_ID, slot, owner=phone):
+        slots = slot_cache.get_slots(EVENT_TYPE_ID, owner=phone)
+        if not slots:
+            context.pop("offered_slots", None)
+            update_state(phone, "confirmed", context, clinic_id=clinic.id)
+            return "😔 That time is no longer available and no other times are available right now. Type NEW to start again."
+        context["offered_slots"] = slots
+        update_state(phone, "selecting_slot", context, clinic_id=clinic.id)
+        return "😔 That time is no longer available.\n\n" + slot_menu(slots)
+    
+    # Optimistic: the slot is held locally, Cal.com confirms in the background
+    db = get_db()
+    appointment = Appointment(
+        clinic_id=clinic.id,
+        patient_phone=phone,
+        reference_number=context.get("reference"),
+        event_type_id=str(EVENT_TYPE_ID),
+        start_time=parse_slot(slot).astimezone(timezone.utc).replace(tzinfo=None),
+        status="pending"
+    )
+    db.add(appointment)
+    db.commit()
+    book_async(appointment.id, slot)
+    
+    context.pop("offered_slots", None)
+    context["appointment_slot"] = slot
+    update_state(phone, "confirmed", context, clinic_id=clinic.id)
+    
+    return f"""📅 *Appointment Requested*
+
+*Time:* {format_slot(slot)}
+*Reference:* `{context.get('reference')}`
+
+We're confirming this time with the hospital and will message you if it can't be booked. Reply STATUS to check or NEW for another consultation."""
+
 def handle_confirmed(msg, phone, patient, context, clinic):
     msg_upper = msg.upper()
     
@@ -184,7 +257,13 @@ def handle_confirmed(msg, phone, patient, context, clinic):
         recent = db.query(Consultation).filter_by(patient_phone=phone, clinic_id=clinic.id).order_by(Consultation.created_at.desc()).first()
         
         if recent:
-            return f"📋 *Last Consultation*\nReference: `{recent.reference_number}`\n\nType NEW for new consultation."
+            appointment = db.query(Appointment).filter_by(reference_number=recent.reference_number, clinic_id=clinic.id).order_by(Appointment.created_at.desc()).first()
+            appointment_line = ""
+            if appointment:
+                status = {"pending": "⏳ Confirming", "confirmed": "✅ Confirmed", "failed": "❌ Could not be booked - type NEW to choose again"}.get(appointment.status, appointment.status)
+                when = format_slot(context["appointment_slot"]) if context.get("appointment_slot") else appointment.start_time.strftime("%d %b %H:%M UTC")
+                appointment_line = f"\nAppointment: {when} ({status})"
+            return f"📋 *Last Consultation*\nReference: `{recent.reference_number}`{appointment_line}\n\nType NEW for new consultation."
         else:
             return "No consultations found. Type NEW to start."
     
@@ -1,8 +1,10 @@
 # models.py - Multi-Clinic Database Models
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, select, Column, Integer, String, DateTime, Text, Boolean, ForeignKey, UniqueConstraint
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+from itertools import chain
 import json
 
 Base = declarative_base()
@@ -18,7 +20,7 @@ class Clinic(Base):
     contact_email = Column(String(100))
     plan = Column(String(20), default="starter")  # starter, professional, enterprise
     is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)  # Keyset pagination order
     
     # Relationships
     patients = relationship("Patient", back_populates="clinic", cascade="all, delete-orphan")
@@ -88,11 +90,113 @@ class ConversationState(Base):
     data = Column(Text, default="{}")  # JSON storage
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# ==================== MESSAGE DELIVERY STATUS ====================
+class MessageStatus(Base):
+    __tablename__ = "message_statuses"
+    
+    id = Column(Integer, primary_key=True)
+    clinic_id = Column(String(50), ForeignKey("clinics.id"), index=True)  # Resolved from the receiving business number
+    message_id = Column(String(128), index=True)  # Meta wamid of the outbound message
+    recipient_phone = Column(String(20))
+    status = Column(String(20))  # sent, delivered, read, failed
+    timestamp = Column(DateTime)  # When Meta recorded the status
+    error_code = Column(Integer)
+    error_title = Column(String(200))
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+# ==================== CAL.COM APPOINTMENTS ====================
+class Appointment(Base):
+    __tablename__ = "appointments"
+    
+    id = Column(Integer, primary_key=True)
+    clinic_id = Column(String(50), ForeignKey("clinics.id"), nullable=False)
+    patient_phone = Column(String, index=True)
+    reference_number = Column(String, index=True)  # Consultation.reference_number
+    event_type_id = Column(String(20))
+    start_time = Column(DateTime)  # UTC
+    status = Column(String(20), default="pending")  # pending, confirmed, failed
+    cal_booking_uid = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# ==================== OUTBOUND CAMPAIGNS ====================
+class CampaignRun(Base):
+    __tablename__ = "campaign_runs"
+    
+    id = Column(Integer, primary_key=True)
+    campaign = Column(String(50), index=True)
+    last_id = Column(Integer, default=0)  # Checkpoint: recipients up to this source id are done
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    status = Column(String(20), default="running")  # running, completed
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+class CampaignMessage(Base):
+    __tablename__ = "campaign_messages"
+    __table_args__ = (UniqueConstraint("campaign", "recipient_key"),)  # One message per recipient, ever
+    
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey("campaign_runs.id"), index=True)
+    campaign = Column(String(50))
+    recipient_key = Column(String(100))  # e.g. consultation:42, patient:7:2026-04-01
+    phone = Column(String(20))
+    status = Column(String(20), default="queued")  # queued, sent, failed, retry (transient - claimed again next run)
+    message_id = Column(String(128))  # Meta wamid - joins to message_statuses
+    error = Column(String(200))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+# ==================== TABLE VERSIONS ====================
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    
+    name = Column(String(50), primary_key=True)  # e.g. clinics
+    version = Column(Integer, default=0)
+    modified = Column(DateTime, default=datetime.utcnow)
+
 # ==================== DATABASE SETUP ====================
 engine = create_engine("sqlite:///wca_pro.db", echo=False)
-Base.metadata.create_all(engine)
+
+def _create_schema(engine):
+    """Create missing tables, plus indexes added to tables that already exist (create_all skips those)"""
+    Base.metadata.create_all(engine)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)  # CREATE INDEX only if it's not there yet
+
+_create_schema(engine)
 Session = sessionmaker(bind=engine)
 
+# ==================== CLINIC TABLE VERSION ====================
+# Counter row in table_versions, bumped in the same transaction as any Clinic
+# write, so it is shared by every process/worker and survives restarts. The
+# admin panel derives its ETag/Last-Modified from it with one primary-key read.
+CLINIC_VERSION_KEY = "clinics"
+
+def bump_clinic_version(session):
+    """Invalidate cached admin views - commits/rolls back with `session`'s transaction"""
+    now = datetime.utcnow().replace(microsecond=0)
+    stmt = sqlite_insert(TableVersion).values(name=CLINIC_VERSION_KEY, version=1, modified=now)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[TableVersion.name],
+        set_={"version": TableVersion.version + 1, "modified": now},
+    ))
+
+def get_clinic_version():
+    """(version, last_modified) of the clinics table"""
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(TableVersion.version, TableVersion.modified).where(TableVersion.name == CLINIC_VERSION_KEY)
+        ).first()
+    return (row.version, row.modified) if row else (0, datetime(1970, 1, 1))
+
+@event.listens_for(Session, "after_flush")
+def _track_clinic_changes(session, flush_context):
+    if any(isinstance(obj, Clinic) for obj in chain(session.new, session.dirty, session.deleted)):
+        bump_clinic_version(session)
+
 def get_db():
     """Get database session"""
     return Session()
@@ -100,7 +204,7 @@ def get_db():
 def init_db():
     """Initialize database tables"""
     engine = create_engine("sqlite:///wca_pro.db", echo=False)
-    Base.metadata.create_all(engine)
+    _create_schema(engine)
     print("✅ Database initialized with multi-clinic support!")
 
 def get_patient(phone, clinic_id):
@@ -0,0 +1,281 @@
+# status_ingest.py - Batched Delivery/Read Status Ingestion
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert, func, case, and_
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import aliased
+
+from models import get_db, Clinic, MessageStatus
+from config import STATUS_BATCH_SIZE, STATUS_FLUSH_INTERVAL, STATUS_BUFFER_MAX
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_timestamp(ts, message_id):
+    try:
+        return datetime.utcfromtimestamp(int(ts)) if ts else None
+    except (TypeError, ValueError, OverflowError, OSError):
+        logger.warning("Ignoring malformed status timestamp %r", ts, extra={"message_id": message_id})
+        return None
+
+
+def parse_statuses(value):
+    """
+    Fast path: turn a webhook `value` with a `statuses` array into insert rows.
+    No DB access - clinic resolution happens at flush time. Runs inline in the
+    webhook, so malformed entries are skipped or nulled, never raised.
+    """
+    business_phone = (value.get("metadata") or {}).get("display_phone_number")
+    rows = []
+    for s in value.get("statuses") or ():
+        if not isinstance(s, dict):
+            logger.warning("Skipping malformed status entry of type %s", type(s).__name__)
+            continue
+        errors = s.get("errors")
+        error = errors[0] if isinstance(errors, list) and errors and isinstance(errors[0], dict) else {}
+        error_code = error.get("code")
+        rows.append({
+            "business_phone": business_phone,
+            "message_id": s.get("id"),
+            "recipient_phone": s.get("recipient_id"),
+            "status": s.get("status"),
+            "timestamp": _parse_timestamp(s.get("timestamp"), s.get("id")),
+            "error_code": error_code if isinstance(error_code, int) else None,
+            "error_title": error.get("title"),
+        })
+    return rows
+
+
+class StatusBuffer:
+    """
+    In-memory buffer of status rows, written with one executemany INSERT
+    per batch. A background thread flushes when `batch_size` rows are
+    waiting or `flush_interval` seconds have passed, whichever comes first.
+    """
+
+    def __init__(self, batch_size=STATUS_BATCH_SIZE, flush_interval=STATUS_FLUSH_INTERVAL, max_size=STATUS_BUFFER_MAX):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._clinic_ids = {}
+
+    def add_many(self, rows):
+        """Queue rows for insertion - never touches the DB"""
+        if not rows:
+            return
+        with self._lock:
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="status-flusher", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("💥 Status flush failed: %s", e)
+
+    def _resolve_clinics(self, db, business_phones):
+        """
+        Map each distinct business phone in a batch to a clinic id with at most
+        one query. Hits are cached for good; misses map to None for this flush
+        only, since the clinic may be registered later.
+        """
+        resolved = {phone: self._clinic_ids.get(phone) for phone in business_phones if phone}
+        unknown = [phone for phone, clinic_id in resolved.items() if clinic_id is None]
+        if unknown:
+            by_number = {}
+            for phone in unknown:
+                digits = phone.lstrip("+")
+                by_number[digits] = by_number[f"+{digits}"] = phone
+            for clinic_id, clinic_phone in db.query(Clinic.id, Clinic.phone).filter(Clinic.phone.in_(list(by_number))):
+                phone = by_number[clinic_phone]
+                if resolved[phone] is None:
+                    resolved[phone] = self._clinic_ids[phone] = clinic_id
+        return resolved
+
+    def _requeue(self, rows):
+        """
+        Put unwritten rows back at the front (they are the oldest). If that
+        overflows the buffer, the oldest rows are the ones dropped - same as
+        a normal append to the bounded deque.
+        """
+        with self._lock:
+            overflow = len(rows) + len(self._rows) - self._rows.maxlen
+            if overflow > 0:
+                logger.error("Status buffer full - dropping %d oldest statuses", overflow)
+                rows = rows[overflow:]
+            self._rows.extendleft(reversed(rows))
+
+    def flush(self):
+        """
+        Write everything currently buffered. Returns the number of rows inserted.
+
+        OperationalError (DB locked/unavailable) is treated as transient: the
+        unwritten rows are requeued and the error re-raised. Any other DB error
+        means bad data, so the batch is bisected and rows that fail on their
+        own are logged and dropped instead of being retried forever.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._rows)
+                self._rows.clear()
+            if not batch:
+                return 0
+
+            db = get_db()
+            written = 0
+            try:
+                try:
+                    # Retried rows are already resolved and have no business_phone
+                    clinic_ids = self._resolve_clinics(db, {row["business_phone"] for row in batch if "business_phone" in row})
+                    for row in batch:
+                        if "business_phone" in row:
+                            row["clinic_id"] = clinic_ids.get(row.pop("business_phone"))
+                except OperationalError:
+                    db.rollback()
+                    self._requeue(batch)
+                    raise
+
+                pending = [batch]
+                while pending:
+                    rows = pending.pop()
+                    try:
+                        for start in range(0, len(rows), self.batch_size):
+                            db.execute(insert(MessageStatus), rows[start:start + self.batch_size])
+                        db.commit()
+                        written += len(rows)
+                    except OperationalError:
+                        db.rollback()
+                        self._requeue([row for chunk in pending for row in chunk] + rows)
+                        raise
+                    except SQLAlchemyError as e:
+                        db.rollback()
+                        if len(rows) == 1:
+                            logger.error("Dropping unwritable status row: %s", e, extra={"message_id": rows[0].get("message_id")})
+                            continue
+                        mid = len(rows) // 2
+                        pending += [rows[mid:], rows[:mid]]
+            finally:
+                db.close()
+
+            logger.debug("Flushed %d message statuses", written)
+            return written
+
+    def stop(self):
+        """Stop the flusher thread and write whatever is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("💥 Final status flush failed: %s", e)
+
+
+# Singleton instance
+status_buffer = StatusBuffer()
+
+
+def delivery_stats(db, since=None):
+    """
+    Per-clinic delivery success rate and latency.
+    Latency is measured from the `sent` status to `delivered` for each message.
+    """
+    filters = [MessageStatus.timestamp >= since] if since else []
+
+    totals = db.query(
+        MessageStatus.clinic_id,
+        func.count(func.distinct(MessageStatus.message_id)),
+        func.count(func.distinct(case((MessageStatus.status.in_(["delivered", "read"]), MessageStatus.message_id)))),
+        func.count(func.distinct(case((MessageStatus.status == "read", MessageStatus.message_id)))),
+        func.count(func.distinct(case((MessageStatus.status == "failed", MessageStatus.message_id)))),
+    ).filter(*filters).group_by(MessageStatus.clinic_id).all()
+
+    sent = aliased(MessageStatus)
+    delivered = aliased(MessageStatus)
+    latency_seconds = (func.julianday(delivered.timestamp) - func.julianday(sent.timestamp)) * 86400
+    latencies = dict(db.query(
+        sent.clinic_id,
+        func.avg(latency_seconds),
+    ).join(delivered, and_(
+        delivered.message_id == sent.message_id,
+        delivered.status == "delivered",
+    )).filter(
+        sent.status == "sent",
+        *([sent.timestamp >= since] if since else [])
+    ).group_by(sent.clinic_id).all())
+
+    stats = {}
+    for clinic_id, total, delivered_count, read_count, failed in totals:
+        stats[clinic_id] = {
+            "messages": total,
+            "delivered": delivered_count,
+            "read": read_count,
+            "failed": failed,
+            "success_rate": round(delivered_count / total, 4) if total else None,
+            "avg_delivery_seconds": round(latencies[clinic_id], 2) if latencies.get(clinic_id) is not None else None,
+        }
+    return stats
+
+
+def _benchmark(n=1000):
+    """Rows/second through parse + buffered batch insert vs one transaction per callback"""
+    value = {
+        "metadata": {"display_phone_number": "254700000000"},
+        "statuses": [{"id": "wamid.bench", "recipient_id": "254724896761", "status": "delivered", "timestamp": str(int(time.time()))}],
+    }
+
+    start = time.perf_counter()
+    for _ in range(n):
+        db = get_db()
+        for row in parse_statuses(value):
+            row.pop("business_phone")
+            db.add(MessageStatus(**row))
+        db.commit()
+        db.close()
+    per_callback = time.perf_counter() - start
+
+    buffer = StatusBuffer(batch_size=500, flush_interval=3600)
+    start = time.perf_counter()
+    for _ in range(n):
+        buffer.add_many(parse_statuses(value))
+    ingest = time.perf_counter() - start
+    buffer.stop()
+    total = time.perf_counter() - start
+
+    print(f"transaction per callback:  {n / per_callback:10.0f} statuses/s")
+    print(f"buffered (request path):   {ingest / n * 1e6:10.2f} µs/callback")
+    print(f"buffered (incl. flush):    {n / total:10.0f} statuses/s")
+
+    db = get_db()
+    db.query(MessageStatus).filter_by(message_id="wamid.bench").delete()
+    db.commit()
+    db.close()
+
+
+if __name__ == "__main__":
+    _benchmark()
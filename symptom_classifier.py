@@ -0,0 +1,372 @@
+# symptom_classifier.py - Local TF-IDF + Softmax Symptom Classifier
+"""
+Offline classifier trained on historical Consultation records.
+Answers common complaints locally and returns the same dict shape as
+ai_service.analyze_symptoms; callers fall back to the LLM when the
+confidence is below SYMPTOM_CLASSIFIER_THRESHOLD.
+
+    python symptom_classifier.py train    # fit on the consultations table
+    python symptom_classifier.py bench    # training / batch / per-message latency
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from config import SYMPTOM_MODEL_PATH, SYMPTOM_CLASSIFIER_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+SEVERITIES = ["low", "medium", "high", "emergency"]
+MAX_FEATURES = 5000
+MIN_DF = 2
+SOURCE = "local_classifier"
+
+# Results that must never become training labels
+FALLBACK_ASSESSMENT = "Unable to fully analyze symptoms due to technical issue."
+
+DEFAULT_RESULT = {
+    "specialist_needed": "General",
+    "sha_claim_eligible": True,
+    "disclaimer": "This is not a medical diagnosis. Please consult a doctor for proper evaluation.",
+}
+
+# Patient-facing wording for local answers. Fixed per severity - stored LLM
+# output is never reused, since it was written about another patient.
+SEVERITY_TEXT = {
+    "low": {
+        "assessment": "Your symptoms sound mild and are common. They can usually be managed with rest and simple care, but a clinician should confirm.",
+        "recommended_action": "Rest, drink plenty of fluids and book a routine visit if symptoms continue for more than a few days.",
+        "hospital_urgency": "routine",
+    },
+    "medium": {
+        "assessment": "Your symptoms should be checked by a clinician soon. They are not an emergency but may need examination or tests.",
+        "recommended_action": "Visit a clinic today or tomorrow. Go sooner if symptoms get worse.",
+        "hospital_urgency": "same-day",
+    },
+    "high": {
+        "assessment": "Your symptoms may point to a serious problem and need prompt medical attention.",
+        "recommended_action": "Go to a hospital today. Do not wait for symptoms to improve on their own.",
+        "hospital_urgency": "same-day",
+    },
+    "emergency": {
+        "assessment": "Your symptoms may be life-threatening and need emergency care now.",
+        "recommended_action": "Go to the nearest emergency department immediately or call for an ambulance.",
+        "hospital_urgency": "emergency",
+    },
+}
+
+# The LLM prompt's hard emergency rules (chest pain, severe bleeding,
+# unconsciousness, breathing difficulty, poisoning). Any mention always goes
+# to the LLM, whatever the local model's confidence.
+EMERGENCY_PATTERN = re.compile(
+    r"chest\s*pain|bleed|blood|unconscious|faint|passed\s*out|collaps|breath|poison|overdose",
+    re.IGNORECASE,
+)
+
+# Categorical fields that may be learned from history (no free text)
+SPECIALISTS = {"General", "Cardiologist", "Pediatrician", "Dermatologist", "Orthopedic", "Other"}
+
+
+def tokenize(text):
+    """Lowercased word unigrams + bigrams"""
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class CSR:
+    """Minimal row-sparse matrix: enough for X @ W and X.T @ G in NumPy"""
+
+    def __init__(self, indptr, indices, data, n_cols):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_cols = n_cols
+        self.n_rows = len(indptr) - 1
+        self.row_ids = np.repeat(np.arange(self.n_rows), np.diff(indptr))
+
+    def dot(self, W):
+        weights = self.data[:, None] * W[self.indices]
+        return np.stack([
+            np.bincount(self.row_ids, weights=weights[:, c], minlength=self.n_rows)
+            for c in range(W.shape[1])
+        ], axis=1).astype(W.dtype)
+
+    def t_dot(self, G):
+        weights = self.data[:, None] * G[self.row_ids]
+        return np.stack([
+            np.bincount(self.indices, weights=weights[:, c], minlength=self.n_cols)
+            for c in range(G.shape[1])
+        ], axis=1).astype(G.dtype)
+
+
+class SymptomClassifier:
+    def __init__(self, vocab, idf, W, b, classes, specialists, sha_eligible):
+        self.vocab = vocab
+        self.idf = idf
+        self.W = W
+        self.b = b
+        self.classes = list(classes)
+        self.specialists = list(specialists)  # Most common specialist per class
+        self.sha_eligible = list(sha_eligible)  # Majority SHA eligibility per class
+
+    # ==================== FEATURES ====================
+
+    @staticmethod
+    def _fit_vocab(token_lists):
+        df = Counter()
+        for tokens in token_lists:
+            df.update(set(tokens))
+        terms = [t for t, n in df.most_common(MAX_FEATURES) if n >= MIN_DF]
+        vocab = {t: i for i, t in enumerate(terms)}
+        n_docs = len(token_lists)
+        idf = np.log((1 + n_docs) / (1 + np.array([df[t] for t in terms], dtype=np.float32))) + 1
+        return vocab, idf.astype(np.float32)
+
+    def transform(self, texts):
+        """Sublinear TF-IDF, L2-normalised rows, as a CSR matrix"""
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            counts = Counter(self.vocab[t] for t in tokenize(text) if t in self.vocab)
+            cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            vals = (1 + np.log(tf)) * self.idf[cols]
+            norm = np.sqrt((vals ** 2).sum())
+            indices.append(cols)
+            data.append(vals / norm if norm else vals)
+            indptr.append(indptr[-1] + len(cols))
+        return CSR(
+            np.array(indptr, dtype=np.int64),
+            np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+            np.concatenate(data).astype(np.float32) if data else np.zeros(0, dtype=np.float32),
+            len(self.vocab),
+        )
+
+    # ==================== TRAINING ====================
+
+    @classmethod
+    def train(cls, texts, labels, results, epochs=300, lr=0.1, l2=1e-4):
+        """
+        texts: symptom strings, labels: severity strings,
+        results: the analyze_symptoms dict recorded for each text - only its
+        categorical fields (specialist_needed, sha_claim_eligible) are used
+        """
+        classes = [c for c in SEVERITIES if c in set(labels)]
+        if len(classes) < 2:
+            raise ValueError("Need at least two severity classes to train")
+
+        vocab, idf = cls._fit_vocab([tokenize(t) for t in texts])
+        model = cls(vocab, idf, None, None, classes, [], [])
+        X = model.transform(texts)
+        y = np.array([classes.index(l) for l in labels])
+        Y = np.eye(len(classes), dtype=np.float32)[y]
+
+        # Class weights so rare emergencies aren't drowned out by common colds
+        weights = (len(y) / (len(classes) * np.bincount(y, minlength=len(classes)))).astype(np.float32)[y][:, None]
+
+        # Full-batch softmax regression with Adam
+        W = np.zeros((len(vocab), len(classes)), dtype=np.float32)
+        b = np.zeros(len(classes), dtype=np.float32)
+        mW, vW = np.zeros_like(W), np.zeros_like(W)
+        mb, vb = np.zeros_like(b), np.zeros_like(b)
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        for step in range(1, epochs + 1):
+            P = _softmax(X.dot(W) + b)
+            G = (P - Y) * weights / len(y)
+            gW = X.t_dot(G) + l2 * W
+            gb = G.sum(axis=0)
+            mW = beta1 * mW + (1 - beta1) * gW
+            vW = beta2 * vW + (1 - beta2) * gW ** 2
+            mb = beta1 * mb + (1 - beta1) * gb
+            vb = beta2 * vb + (1 - beta2) * gb ** 2
+            correction = np.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+            W -= lr * correction * mW / (np.sqrt(vW) + eps)
+            b -= lr * correction * mb / (np.sqrt(vb) + eps)
+        model.W, model.b = W, b
+
+        # Per-class categorical defaults from history
+        for c in range(len(classes)):
+            members = [results[i] for i in np.flatnonzero(y == c)]
+            specialists = Counter(r.get("specialist_needed") for r in members if r.get("specialist_needed") in SPECIALISTS)
+            model.specialists.append(specialists.most_common(1)[0][0] if specialists else DEFAULT_RESULT["specialist_needed"])
+            eligible = [r["sha_claim_eligible"] for r in members if isinstance(r.get("sha_claim_eligible"), bool)]
+            model.sha_eligible.append(sum(eligible) * 2 >= len(eligible) if eligible else DEFAULT_RESULT["sha_claim_eligible"])
+        return model
+
+    # ==================== INFERENCE ====================
+
+    def predict_proba(self, texts):
+        """Batch scoring: (n_texts, n_classes) probabilities"""
+        return _softmax(self.transform(texts).dot(self.W) + self.b)
+
+    def classify(self, symptom_text):
+        """Return an analyze_symptoms-shaped dict; `confidence` is the model probability"""
+        proba = self.predict_proba([symptom_text])[0]
+        c = int(proba.argmax())
+        severity = self.classes[c]
+
+        result = {**DEFAULT_RESULT, **SEVERITY_TEXT[severity]}
+        result["severity"] = severity
+        result["specialist_needed"] = self.specialists[c]
+        result["sha_claim_eligible"] = bool(self.sha_eligible[c])
+        result["confidence"] = round(float(proba[c]), 4)
+        result["source"] = SOURCE
+        return result
+
+    # ==================== PERSISTENCE ====================
+
+    def save(self, path=SYMPTOM_MODEL_PATH):
+        terms = sorted(self.vocab, key=self.vocab.get)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                terms=np.array(terms, dtype=str), idf=self.idf, W=self.W, b=self.b,
+                classes=np.array(self.classes, dtype=str),
+                specialists=np.array(self.specialists, dtype=str),
+                sha_eligible=np.array(self.sha_eligible, dtype=bool),
+            )
+
+    @classmethod
+    def load(cls, path=SYMPTOM_MODEL_PATH):
+        with np.load(path) as f:
+            vocab = {t: i for i, t in enumerate(f["terms"].tolist())}
+            return cls(vocab, f["idf"], f["W"], f["b"], f["classes"].tolist(),
+                       f["specialists"].tolist(), f["sha_eligible"].tolist())
+
+
+# ==================== SERVICE HOOK ====================
+
+_model = None
+_model_mtime = None
+
+
+def get_model():
+    """Lazily load the trained model; reloads if the file is retrained. None if untrained."""
+    global _model, _model_mtime
+    try:
+        mtime = os.path.getmtime(SYMPTOM_MODEL_PATH)
+    except OSError:
+        return None
+    if mtime != _model_mtime:
+        try:
+            _model = SymptomClassifier.load(SYMPTOM_MODEL_PATH)
+            _model_mtime = mtime
+        except Exception as e:
+            logger.error("Failed to load symptom model: %s", e)
+            return None
+    return _model
+
+
+def classify_if_confident(symptom_text, threshold=SYMPTOM_CLASSIFIER_THRESHOLD):
+    """
+    Local result when confidence >= threshold and no emergency term is
+    mentioned, otherwise None (caller should ask the LLM)
+    """
+    if EMERGENCY_PATTERN.search(symptom_text or ""):
+        return None
+    model = get_model()
+    if model is None:
+        return None
+    result = model.classify(symptom_text)
+    if result["confidence"] < threshold:
+        return None
+    return result
+
+
+def load_training_data(db):
+    """(texts, labels, results) from LLM-assessed consultations"""
+    from models import Consultation
+
+    texts, labels, results = [], [], []
+    rows = db.query(Consultation.symptoms, Consultation.severity, Consultation.ai_assessment).filter(
+        Consultation.symptoms.isnot(None),
+        Consultation.severity.in_(SEVERITIES),
+    ).yield_per(1000)
+    for symptoms, severity, assessment in rows:
+        try:
+            result = json.loads(assessment or "{}")
+        except ValueError:
+            continue
+        # Skip the outage fallback and our own predictions - only learn from the LLM
+        if result.get("assessment") == FALLBACK_ASSESSMENT or result.get("source") == SOURCE:
+            continue
+        texts.append(symptoms)
+        labels.append(severity)
+        results.append(result)
+    return texts, labels, results
+
+
+# ==================== CLI ====================
+
+def _synthetic_corpus(n, seed=0):
+    """Template-generated complaints for benchmarking without real patient data"""
+    rng = np.random.default_rng(seed)
+    phrases = {
+        "low": ["mild headache", "runny nose", "slight cough", "itchy skin rash", "sore throat", "tired"],
+        "medium": ["fever for three days", "vomiting and diarrhea", "ear pain", "back pain when walking", "painful urination"],
+        "high": ["high fever and stiff neck", "blood in stool", "severe abdominal pain", "fainted this morning"],
+        "emergency": ["chest pain spreading to arm", "severe bleeding", "cannot breathe", "swallowed poison"],
+    }
+    filler = ["i have", "since yesterday", "please help", "my child has", "and also", "doctor", "for two days", "at night"]
+    texts, labels, results = [], [], []
+    for _ in range(n):
+        severity = SEVERITIES[rng.choice(4, p=[0.45, 0.35, 0.15, 0.05])]
+        words = [phrases[severity][rng.integers(len(phrases[severity]))]]
+        words += [filler[i] for i in rng.integers(len(filler), size=3)]
+        if rng.random() < 0.3:
+            other = SEVERITIES[rng.integers(4)]
+            words.append(phrases[other][rng.integers(len(phrases[other]))])
+        rng.shuffle(words)
+        texts.append(" ".join(words))
+        labels.append(severity)
+        results.append({"severity": severity, "assessment": f"Synthetic {severity} case.",
+                        "recommended_action": "See a clinician.", "hospital_urgency": "routine"})
+    return texts, labels, results
+
+
+def _benchmark(n_train=5000, n_batch=20000, n_single=2000):
+    texts, labels, results = _synthetic_corpus(n_train)
+
+    start = time.perf_counter()
+    model = SymptomClassifier.train(texts, labels, results)
+    print(f"train ({n_train} docs, {len(model.vocab)} features): {time.perf_counter() - start:8.2f} s")
+
+    batch, batch_labels, _ = _synthetic_corpus(n_batch, seed=1)
+    start = time.perf_counter()
+    proba = model.predict_proba(batch)
+    elapsed = time.perf_counter() - start
+    accuracy = (np.array(model.classes)[proba.argmax(axis=1)] == np.array(batch_labels)).mean()
+    print(f"batch score ({n_batch} docs):     {n_batch / elapsed:8.0f} docs/s  (accuracy {accuracy:.3f})")
+
+    gated = 0
+    start = time.perf_counter()
+    for text in batch[:n_single]:
+        if model.classify(text)["confidence"] >= SYMPTOM_CLASSIFIER_THRESHOLD:
+            gated += 1
+    elapsed = time.perf_counter() - start
+    print(f"per-message classify:         {elapsed / n_single * 1e6:8.1f} µs  "
+          f"({gated / n_single:.0%} answered locally at threshold {SYMPTOM_CLASSIFIER_THRESHOLD})")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "bench"
+    if command == "train":
+        from models import get_db
+        texts, labels, results = load_training_data(get_db())
+        model = SymptomClassifier.train(texts, labels, results)
+        model.save()
+        print(f"✅ Trained on {len(texts)} consultations -> {SYMPTOM_MODEL_PATH}")
+    else:
+        _benchmark()
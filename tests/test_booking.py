@@ -0,0 +1,225 @@
+# tests/test_booking.py - Cal.com Booking Flow Against the Local Fake Server
+"""
+Runs SlotCache, confirm_booking and the slot-selection states of the
+triage flow against booking._fake_cal_server and a temporary SQLite DB.
+
+    python -m unittest discover tests
+"""
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+import logic
+import models
+from booking import SlotCache, CalClient, confirm_booking, _fake_cal_server
+from models import get_db, Appointment, Clinic, ConversationState
+
+EVENT_TYPE = "1"
+PHONE = "254700000101"
+OTHER_PHONE = "254700000202"
+
+
+class FakeCalTestCase(unittest.TestCase):
+    """Fresh fake Cal.com, warm slot cache and empty temporary DB per test"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.engine = create_engine(f"sqlite:///{os.path.join(cls.tmp_dir, 'test.db')}")
+        models._create_schema(cls.engine)
+        models.Session.configure(bind=cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        models.Session.configure(bind=models.engine)
+        cls.engine.dispose()
+        os.remove(os.path.join(cls.tmp_dir, "test.db"))
+        os.rmdir(cls.tmp_dir)
+
+    def setUp(self):
+        models.Base.metadata.drop_all(self.engine)
+        models._create_schema(self.engine)
+        # No background refresher - tests call refresh() themselves so the cache is deterministic
+        patch = mock.patch.object(SlotCache, "_ensure_started")
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.server, base_url = _fake_cal_server(latency=0)
+        self.cache = SlotCache(CalClient(api_key="test", base_url=base_url), refresh_interval=3600)
+        self.cache.refresh(EVENT_TYPE)
+        self.slots = self.cache.get_slots(EVENT_TYPE)
+        self.notify = mock.Mock()
+
+    def tearDown(self):
+        self.cache.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_appointment(self, slot, phone=PHONE, clinic_id="clinicA"):
+        db = get_db()
+        if not db.get(Clinic, clinic_id):
+            db.add(Clinic(id=clinic_id, name=clinic_id, is_active=True))
+        appointment = Appointment(clinic_id=clinic_id, patient_phone=phone, reference_number="WCATEST01",
+                                  event_type_id=EVENT_TYPE, status="pending")
+        db.add(appointment)
+        db.commit()
+        appointment_id = appointment.id
+        db.close()
+        return appointment_id
+
+
+class SlotCacheTest(FakeCalTestCase):
+
+    def test_hold_is_shared_by_every_clinic_on_the_event_type(self):
+        slot = self.slots[0]
+        self.assertTrue(self.cache.reserve(EVENT_TYPE, slot, owner=PHONE))
+        self.assertFalse(self.cache.reserve(EVENT_TYPE, slot, owner=OTHER_PHONE))
+        self.assertNotIn(slot, self.cache.get_slots(EVENT_TYPE, owner=OTHER_PHONE))
+        self.assertIn(slot, self.cache.get_slots(EVENT_TYPE, owner=PHONE))
+
+    def test_reserve_rejects_stale_cache(self):
+        cache = SlotCache(self.cache.client, ttl=0.05, refresh_interval=3600)
+        cache.refresh(EVENT_TYPE)
+        time.sleep(0.1)
+        self.assertFalse(cache.reserve(EVENT_TYPE, self.slots[0], owner=PHONE))
+        cache.stop()
+
+    def test_reserve_rejects_missing_past_and_unknown_slots(self):
+        self.assertFalse(self.cache.reserve("999", self.slots[0], owner=PHONE))
+        self.assertFalse(self.cache.reserve(EVENT_TYPE, "2000-01-03T06:00:00Z", owner=PHONE))
+        self.assertFalse(self.cache.reserve(EVENT_TYPE, "2099-01-01T09:00:00+03:00", owner=PHONE))
+
+
+class ConfirmBookingTest(FakeCalTestCase):
+
+    def test_success_confirms_and_does_not_notify(self):
+        slot = self.slots[0]
+        self.cache.reserve(EVENT_TYPE, slot, owner=PHONE)
+        appointment = confirm_booking(self.add_appointment(slot), slot, self.cache, self.notify)
+        self.assertEqual(appointment.status, "confirmed")
+        self.assertTrue(appointment.cal_booking_uid)
+        self.notify.assert_not_called()
+
+    def test_failure_releases_hold_invalidates_and_notifies(self):
+        slot = self.slots[0]
+        self.cache.client.create_booking(EVENT_TYPE, slot, name="Someone", email="x@example.invalid")  # Taken on Cal.com
+        self.cache.reserve(EVENT_TYPE, slot, owner=PHONE)
+
+        appointment = confirm_booking(self.add_appointment(slot), slot, self.cache, self.notify)
+
+        self.assertEqual(appointment.status, "failed")
+        self.assertEqual(self.cache.get_slots(EVENT_TYPE), [])  # Availability dropped until refetched
+        self.cache.refresh(EVENT_TYPE)
+        self.assertNotIn(slot, self.cache.get_slots(EVENT_TYPE))
+        self.assertFalse(self.cache.reserve(EVENT_TYPE, slot, owner=OTHER_PHONE))
+        self.assertNotIn((EVENT_TYPE, slot), self.cache._holds)
+        self.notify.assert_called_once()
+        phone, text = self.notify.call_args[0]
+        self.assertEqual(phone, PHONE)
+        self.assertIn("Appointment Not Booked", text)
+
+    def test_only_pending_appointments_are_booked(self):
+        slot = self.slots[0]
+        appointment_id = self.add_appointment(slot)
+        db = get_db()
+        db.get(Appointment, appointment_id).status = "confirmed"
+        db.commit()
+        db.close()
+        with mock.patch.object(self.cache.client, "create_booking") as create_booking:
+            confirm_booking(appointment_id, slot, self.cache, self.notify)
+        create_booking.assert_not_called()
+
+
+class TriageSlotFlowTest(FakeCalTestCase):
+    """selecting_hospital / selecting_slot transitions through logic.triage"""
+
+    def setUp(self):
+        super().setUp()
+        self.booked = []
+        patches = [
+            mock.patch.object(logic, "slot_cache", self.cache),
+            mock.patch.object(logic, "EVENT_TYPE_ID", EVENT_TYPE),
+            mock.patch.object(logic, "book_async", lambda appointment_id, slot: self.booked.append((appointment_id, slot))),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.clinic = logic.get_clinic_by_phone(PHONE)
+
+    def set_state(self, state, context):
+        logic.get_or_create_state(PHONE, self.clinic.id)
+        logic.update_state(PHONE, state, context, clinic_id=self.clinic.id)
+
+    def state(self):
+        db = get_db()
+        row = db.query(ConversationState).filter_by(phone=PHONE, clinic_id=self.clinic.id).first()
+        db.close()
+        return row.state, json.loads(row.data)
+
+    def test_picking_a_slot_holds_it_and_books_in_background(self):
+        self.set_state("selecting_slot", {"offered_slots": self.slots, "reference": "WCATEST01"})
+        reply = logic.triage("1", PHONE)
+
+        self.assertIn("Appointment Requested", reply)
+        state, context = self.state()
+        self.assertEqual(state, "confirmed")
+        self.assertEqual(context["appointment_slot"], self.slots[0])
+        self.assertNotIn("offered_slots", context)
+        self.assertEqual([slot for _, slot in self.booked], [self.slots[0]])
+        db = get_db()
+        self.assertEqual(db.get(Appointment, self.booked[0][0]).status, "pending")
+        db.close()
+        self.assertNotIn(self.slots[0], self.cache.get_slots(EVENT_TYPE, owner=OTHER_PHONE))
+
+    def test_slot_held_by_someone_else_is_reoffered(self):
+        self.cache.reserve(EVENT_TYPE, self.slots[0], owner=OTHER_PHONE)
+        self.set_state("selecting_slot", {"offered_slots": self.slots, "reference": "WCATEST01"})
+        reply = logic.triage("1", PHONE)
+
+        self.assertIn("no longer available", reply)
+        state, context = self.state()
+        self.assertEqual(state, "selecting_slot")
+        self.assertNotIn(self.slots[0], context["offered_slots"])
+        self.assertEqual(self.booked, [])
+
+    def test_stale_cache_with_nothing_left_ends_selection(self):
+        self.cache.invalidate(EVENT_TYPE)
+        self.set_state("selecting_slot", {"offered_slots": self.slots, "reference": "WCATEST01"})
+        reply = logic.triage("1", PHONE)
+
+        self.assertIn("no other times are available", reply)
+        self.assertEqual(self.state()[0], "confirmed")
+        self.assertEqual(self.booked, [])
+
+    def test_skip_and_invalid_choice(self):
+        self.set_state("selecting_slot", {"offered_slots": self.slots, "reference": "WCATEST01"})
+        self.assertIn("Invalid selection", logic.triage("9", PHONE))
+        self.assertEqual(self.state()[0], "selecting_slot")
+        logic.triage("SKIP", PHONE)
+        self.assertEqual(self.state()[0], "confirmed")
+        self.assertEqual(self.booked, [])
+
+    def test_hospital_selection_offers_slots(self):
+        self.set_state("selecting_hospital", {"symptoms": "cough", "ai_result": {"severity": "low"}})
+        reply = logic.triage("1", PHONE)
+
+        self.assertIn("Pick an appointment time", reply)
+        self.assertEqual(self.state()[0], "selecting_slot")
+
+    def test_emergency_is_never_offered_slots(self):
+        self.set_state("selecting_hospital", {"symptoms": "chest pain", "ai_result": {"severity": "emergency"}, "is_emergency": True})
+        reply = logic.triage("1", PHONE)
+
+        self.assertNotIn("Pick an appointment time", reply)
+        self.assertIn("Go to the hospital now", reply)
+        state, context = self.state()
+        self.assertEqual(state, "confirmed")
+        self.assertNotIn("offered_slots", context)
+
+
+if __name__ == "__main__":
+    unittest.main()
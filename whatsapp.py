@@ -30,11 +30,11 @@ class WhatsAppService:
                 to=to_number
             )
             
-            logger.info(f"Message sent: {message.sid} to {to_number}")
+            logger.info("Message sent: %s", message.sid, extra={"to_number": to_number})
             return message.sid
             
         except Exception as e:
-            logger.error(f"Failed to send message: {e}")
+            logger.error("Failed to send message: %s", e, extra={"to_number": to_number})
             raise
     
     def validate_request(self, request):